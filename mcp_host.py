@@ -1,15 +1,22 @@
 """MCP Host with support for multiple servers."""
 import asyncio
+import hashlib
+import json
 import sys
-from typing import Dict, List, Optional, Any, TypedDict
-from contextlib import AsyncExitStack
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Any
+from contextlib import AsyncExitStack, aclosing
 import os
 
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client, get_default_environment
 from mcp.types import Tool, CallToolResult
 
-from anthropic import Anthropic, AsyncAnthropic
+import anyio
+import httpx
+from anthropic import Anthropic, AsyncAnthropic, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 
 load_dotenv()  # load environment variables from .env
@@ -18,6 +25,43 @@ load_dotenv()  # load environment variables from .env
 if not os.getenv("ANTHROPIC_API_KEY"):
     print("Warning: ANTHROPIC_API_KEY is not set in environment variables")
 
+# Errors from a broken server connection that are worth reconnecting for
+RETRYABLE_ERRORS = (
+    ConnectionError,
+    anyio.EndOfStream,
+    anyio.BrokenResourceError,
+    anyio.ClosedResourceError,
+    asyncio.IncompleteReadError,
+)
+# Attempts per tool call, and the first backoff delay in seconds (doubled each retry)
+TOOL_CALL_ATTEMPTS = 3
+TOOL_CALL_BACKOFF = 0.1
+
+# Maximum number of responses kept by LLMManager's response cache
+RESPONSE_CACHE_SIZE = 256
+
+# Marker yielded by LLMManager.stream_response where buffered output should be
+# shown immediately (end of a content block, before waiting on tools)
+STREAM_FLUSH = object()
+
+# Headers enabling Anthropic prompt caching on messages.create
+PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+# Shared Anthropic client so every LLMManager reuses the same connection pool.
+# Keeps the SDK's default client settings and pool size, but holds idle
+# connections for 60s instead of 5s so they survive the gap between turns.
+# The pool is bound to one event loop: the CLI runs a single loop, and the
+# Streamlit app submits all work to one shared loop.
+_SHARED_ANTHROPIC = AsyncAnthropic(
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=1000,
+            max_keepalive_connections=100,
+            keepalive_expiry=60
+        )
+    )
+)
+
 class Transport:
     """Manages the transport layer with a server."""
     
@@ -71,19 +115,38 @@ class Transport:
 class Client:
     """Represents a client that maintains a session with a server."""
     
-    def __init__(self, server_name: str, transport: Transport):
+    def __init__(
+        self,
+        server_name: str,
+        transport: Transport,
+        on_tools_changed: Optional[Callable[[], Awaitable[None]]] = None
+    ):
         """Initialize client.
         
         Args:
             server_name: Unique identifier for this client's server
             transport: Transport instance to use
+            on_tools_changed: Awaited after every tool listing, including the
+                one done on reconnect
         """
         self.server_name = server_name
         self.transport = transport
+        self._on_tools_changed = on_tools_changed
         self.session: Optional[ClientSession] = None
         self._available_tools: list[Tool] = []
+        self._tool_index: dict[str, Tool] = {}
+        self._prebuilt_tool_dicts: list[dict] = []
         self._reconnect_lock = asyncio.Lock()
         self._is_stopping = False
+        self._refcount: int = 0
+        # stdio_client and ClientSession each hold an anyio task group that must
+        # be exited by the task that entered it, so a single owner task opens,
+        # holds and closes the connection; other tasks signal it via _wake.
+        self._owner_task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Future] = None
+        self._wake = asyncio.Event()
+        self._stop_requested = False
+        self._generation: int = 0
         
     @property
     def is_connected(self) -> bool:
@@ -95,47 +158,161 @@ class Client:
         """Get list of available tools from this client's server."""
         return self._available_tools
         
-    async def start(self) -> None:
-        """Start the client session.
+    @property
+    def tool_definitions(self) -> list[dict]:
+        """Get this server's tools formatted for the Claude API, prefixed by server name."""
+        return self._prebuilt_tool_dicts
+        
+    async def start(self, fetch_tools: bool = True) -> None:
+        """Start the client session and take a reference on it.
+        
+        Args:
+            fetch_tools: Whether to list the server's tools before returning.
+                When False the caller is expected to run ``refresh_tools``.
         
         Raises:
             ConnectionError: If session initialization fails
         """
-        if self.is_connected:
+        await self._connect(fetch_tools)
+        self._refcount += 1
+        
+    def _has_session(self, stale_generation: Optional[int]) -> bool:
+        """Check for an active session other than the given stale one."""
+        return self.is_connected and self._generation != stale_generation
+        
+    async def _connect(self, fetch_tools: bool = True, stale_generation: Optional[int] = None) -> None:
+        """Open the session if it is not already active.
+        
+        The session is opened by the owner task, which is started here if it
+        is not running and otherwise asked to close and reopen the session.
+        
+        Args:
+            fetch_tools: Whether to list the server's tools after initializing
+            stale_generation: Generation of a session the caller saw fail. It is
+                replaced only if still current, so concurrent callers that hit
+                the same failure reconnect once between them.
+        
+        Raises:
+            ConnectionError: If session initialization fails
+        """
+        if self._has_session(stale_generation):
             return
             
         async with self._reconnect_lock:
-            try:
-                # Establish transport connection
-                stdio, write = await self.transport.connect()
-                
-                # Create and initialize session
-                self.session = await ClientSession(stdio, write).__aenter__()
-                await self.session.initialize()
+            if self._has_session(stale_generation):
+                return
                 
-                # Update available tools
-                response = await self.session.list_tools()
-                self._available_tools = response.tools
+            self._ready = asyncio.get_running_loop().create_future()
+            if self._owner_task is None or self._owner_task.done():
+                self._owner_task = asyncio.create_task(self._run_connection(fetch_tools))
+            else:
+                self._wake.set()
+            await self._ready
+            
+    async def _run_connection(self, fetch_tools: bool) -> None:
+        """Own the transport and session for as long as the client is running.
+        
+        Opens the session, resolves ``_ready``, then waits to be woken. When
+        woken it closes the session and either exits (on stop) or reopens it.
+        
+        Args:
+            fetch_tools: Whether to list the server's tools on the first open
+        """
+        self._wake.clear()
+        try:
+            while True:
+                try:
+                    # Establish transport connection
+                    stdio, write = await self.transport.connect()
+                    
+                    # Create and initialize session
+                    self.session = await ClientSession(stdio, write).__aenter__()
+                    await self.session.initialize()
+                    
+                    if fetch_tools:
+                        await self.refresh_tools()
+                        
+                except Exception as e:
+                    await self.cleanup()
+                    self._ready.set_exception(ConnectionError(
+                        f"Failed to initialize session with server {self.server_name}: {str(e)}"))
+                    return
+                    
+                self._generation += 1
+                self._ready.set_result(None)
                 
-            except Exception as e:
-                await self.cleanup()
-                raise ConnectionError(
-                    f"Failed to initialize session with server {self.server_name}: {str(e)}")
+                await self._wake.wait()
+                self._wake.clear()
+                if self._stop_requested:
+                    await self.cleanup()
+                    return
                     
+                # Reconnecting: a session that already broke may fail to close
+                # cleanly, which must not prevent opening a new one
+                try:
+                    await self.cleanup()
+                except Exception as e:
+                    print(f"\nError closing session with server {self.server_name}: {str(e)}")
+                fetch_tools = True
+        finally:
+            # Never leave a waiter hanging if this task is cancelled mid-open
+            if self._ready is not None and not self._ready.done():
+                self._ready.set_exception(ConnectionError(
+                    f"Connection to server {self.server_name} was closed"))
+            
+    async def refresh_tools(self) -> None:
+        """Fetch the list of available tools from the server."""
+        response = await self.session.list_tools()
+        self._available_tools = response.tools
+        self._tool_index = {tool.name: tool for tool in response.tools}
+        self._prebuilt_tool_dicts = [{
+            "name": f"{self.server_name}_{tool.name}",
+            "description": f"[{self.server_name}] {tool.description}",
+            "input_schema": tool.inputSchema
+        } for tool in response.tools]
+        if self._on_tools_changed is not None:
+            await self._on_tools_changed()
+        
     async def ensure_connected(self) -> None:
         """Ensure client has an active session, attempting reconnection if necessary."""
         if not self.is_connected:
-            await self.start()
+            await self._connect()
             
-    async def stop(self) -> None:
-        """Stop the client session gracefully."""
-        self._is_stopping = True
-        await self.cleanup()
-        self._is_stopping = False
+    async def stop(self, force: bool = False) -> None:
+        """Release a reference and stop the session once none remain.
+        
+        Args:
+            force: Stop the session even if other references remain
+        """
+        if force:
+            self._refcount = 0
+        elif self._refcount > 0:
+            self._refcount -= 1
+        if self._refcount > 0:
+            return
+            
+        async with self._reconnect_lock:
+            owner_task, self._owner_task = self._owner_task, None
+            if owner_task is None or owner_task.done():
+                return
+                
+            self._is_stopping = True
+            self._stop_requested = True
+            self._wake.set()
+            try:
+                await owner_task
+            finally:
+                self._stop_requested = False
+                self._is_stopping = False
         
     async def cleanup(self) -> None:
-        """Clean up client session resources."""
+        """Clean up client session resources.
+        
+        Must run in the owner task; use ``stop`` from anywhere else.
+        """
         self._available_tools = []
+        self._tool_index = {}
+        self._prebuilt_tool_dicts = []
         if self.session:
             await self.session.__aexit__(None, None, None)
             self.session = None
@@ -157,55 +334,63 @@ class Client:
         """
         await self.ensure_connected()
         
-        if not any(tool.name == tool_name for tool in self._available_tools):
+        if tool_name not in self._tool_index:
             raise ValueError(
                 f"Tool {tool_name} not available on server {self.server_name}")
                 
-        try:
-            return await self.session.call_tool(tool_name, tool_args)
-        except Exception as e:
-            # If connection error, attempt reconnection
-            if isinstance(e, ConnectionError):
-                await self.cleanup()
-                await self.ensure_connected()
-                return await self.session.call_tool(tool_name, tool_args)
-            raise
-
-class Server:
-    """Represents a server in the MCP architecture."""
-    
-    def __init__(self, name: str, command: str, args: list[str]):
-        """Initialize server.
-        
-        Args:
-            name: Unique identifier for this server
-            command: Command to run the server
-            args: Command line arguments
-        """
-        self.name = name
-        self.command = command
-        self.args = args
-
-class McpConnection(TypedDict):
-    """Represents a complete MCP connection."""
-    server: Server
-    client: Client
-    transport: Transport
+        failed_generation = None
+        for attempt in range(TOOL_CALL_ATTEMPTS):
+            try:
+                if failed_generation is not None:
+                    # Back off, then reconnect unless another call already has
+                    await asyncio.sleep(TOOL_CALL_BACKOFF * 2 ** (attempt - 1))
+                    await self._connect(stale_generation=failed_generation)
+                    
+                generation = self._generation
+                session = self.session
+                if session is None:
+                    raise ConnectionError(f"Session with server {self.server_name} is not active")
+                return await session.call_tool(tool_name, tool_args)
+            except RETRYABLE_ERRORS:
+                if attempt == TOOL_CALL_ATTEMPTS - 1:
+                    raise
+                failed_generation = generation
 
 class ConnectionManager:
     """Manages multiple MCP connections."""
     
     def __init__(self):
         """Initialize connection manager."""
-        self.connections: Dict[str, McpConnection] = {}
+        self.clients: Dict[str, Client] = {}
+        # Immutable copy of clients for lock-free readers, rebuilt under _lock
+        self._snapshot: tuple[tuple[str, Client], ...] = ()
         self._lock = asyncio.Lock()
+        self._connecting: set[str] = set()
+        self._tool_tasks: Dict[str, asyncio.Task] = {}
+        self._tools_version: int = 0
+        
+    @property
+    def tools_version(self) -> int:
+        """Get a counter that changes whenever the connections or their tools change."""
+        return self._tools_version
+        
+    def _update_snapshot(self) -> None:
+        """Rebuild the clients snapshot. Must be called with _lock held."""
+        self._snapshot = tuple(self.clients.items())
+        self._tools_version += 1
+        
+    async def _tools_changed(self) -> None:
+        """Invalidate cached tool lists after a client re-lists its tools."""
+        async with self._lock:
+            self._tools_version += 1
         
     async def add_connection(
         self, 
         server_name: str, 
         command: str, 
         args: list[str], 
-        env: dict[str, str] | None = None
+        env: dict[str, str] | None = None,
+        background_tools: bool = False
     ) -> None:
         """Add and establish a new connection.
         
@@ -214,32 +399,76 @@ class ConnectionManager:
             command: Command to run the server
             args: Command line arguments
             env: Optional environment variables
+            background_tools: List the server's tools in a background task
+                instead of before returning; see wait_for_tools. This only helps
+                when the event loop keeps running after connecting (e.g. the
+                Streamlit app), not in the CLI, which blocks on input().
             
         Raises:
             ValueError: If server name already exists
         """
         async with self._lock:
-            if server_name in self.connections:
+            if server_name in self.clients or server_name in self._connecting:
                 raise ValueError(f"Connection to {server_name} already exists")
-                
-            # Create server, transport and client
-            server = Server(server_name, command, args)
+            self._connecting.add(server_name)
+            
+        try:
+            # Create transport and client
             transport = Transport(command, args, env)
-            client = Client(server_name, transport)
+            client = Client(server_name, transport, self._tools_changed)
             
-            # Initialize client
-            await client.start()
+            # Initialize client outside the lock so several servers can start concurrently
+            await client.start(fetch_tools=not background_tools)
             
             # Store connection
-            self.connections[server_name] = {
-                "server": server,
-                "client": client,
-                "transport": transport
-            }
+            async with self._lock:
+                self.clients[server_name] = client
+                if background_tools:
+                    self._tool_tasks[server_name] = asyncio.create_task(
+                        self._load_tools(server_name, client))
+                self._update_snapshot()
+        finally:
+            self._connecting.discard(server_name)
             
+        if background_tools:
+            print(f"\nConnected to server '{server_name}'")
+        else:
             print(f"\nConnected to server '{server_name}' with tools:")
             for tool in client.available_tools:
                 print(f"  - {tool.name}: {tool.description}")
+        
+    async def _load_tools(self, server_name: str, client: Client) -> None:
+        """Populate a client's tools in the background.
+        
+        Args:
+            server_name: Name of the server being loaded
+            client: Client to populate
+        """
+        try:
+            await client.refresh_tools()
+        except Exception as e:
+            # Reported here, by the one task doing the listing, rather than by
+            # each caller of wait_for_tools
+            print(f"\nError listing tools on server '{server_name}': {str(e)}")
+            return
+        
+        print(f"\nTools available on server '{server_name}':")
+        for tool in client.available_tools:
+            print(f"  - {tool.name}: {tool.description}")
+            
+    async def wait_for_tools(self) -> None:
+        """Wait until every connected server has reported its tools.
+        
+        Servers whose tool listing failed contribute no tools.
+        """
+        tool_tasks = list(self._tool_tasks.items())
+        if not tool_tasks:
+            return
+        # Listing errors are handled in _load_tools; this only sees cancellations
+        await asyncio.gather(*(task for _, task in tool_tasks), return_exceptions=True)
+        for server_name, task in tool_tasks:
+            if self._tool_tasks.get(server_name) is task:
+                del self._tool_tasks[server_name]
                   
     async def remove_connection(self, server_name: str) -> None:
         """Remove and close a connection.
@@ -251,11 +480,22 @@ class ConnectionManager:
             ValueError: If connection doesn't exist
         """
         async with self._lock:
-            if server_name not in self.connections:
+            if server_name not in self.clients:
                 raise ValueError(f"Connection to {server_name} does not exist")
                 
-            await self.connections[server_name]["client"].stop()
-            del self.connections[server_name]
+            task = self._tool_tasks.pop(server_name, None)
+            if task:
+                task.cancel()
+            client = self.clients.pop(server_name)
+            self._update_snapshot()
+            # Keep the name reserved until the server has actually exited
+            self._connecting.add(server_name)
+            
+        try:
+            # The registry owns the connection, so its removal always tears it down
+            await client.stop(force=True)
+        finally:
+            self._connecting.discard(server_name)
             
     def get_client(self, server_name: str) -> Client:
         """Get a client by server name.
@@ -269,32 +509,128 @@ class ConnectionManager:
         Raises:
             ValueError: If connection doesn't exist
         """
-        if server_name not in self.connections:
+        if server_name not in self.clients:
             raise ValueError(f"Connection to {server_name} does not exist")
-        return self.connections[server_name]["client"]
+        return self.clients[server_name]
         
-    def get_all_tools(self) -> Dict[str, List[dict]]:
-        """Get tools from all connected servers.
+    def get_all_clients(self) -> tuple[tuple[str, Client], ...]:
+        """Get all connected clients without taking the lock.
         
         Returns:
-            Dictionary mapping server names to their tools
+            Tuple of (server_name, client) pairs
         """
-        server_tools = {}
-        for server_name, connection in self.connections.items():
-            tools = [{
-                "name": tool.name,
-                "description": tool.description,
-                "input_schema": tool.inputSchema
-            } for tool in connection["client"].available_tools]
-            server_tools[server_name] = tools
-        return server_tools
+        return self._snapshot
         
     async def cleanup(self) -> None:
         """Clean up all connections."""
+        for task in self._tool_tasks.values():
+            task.cancel()
+        self._tool_tasks.clear()
+        results = await asyncio.gather(
+            *(client.stop(force=True) for _, client in self._snapshot),
+            return_exceptions=True
+        )
         async with self._lock:
-            for connection in self.connections.values():
-                await connection["client"].stop()
-            self.connections.clear()
+            self.clients.clear()
+            self._update_snapshot()
+            
+        errors = [result for result in results if isinstance(result, BaseException)]
+        for error in errors[1:]:
+            print(f"\nError stopping server: {str(error)}")
+        if errors:
+            raise errors[0]
+
+class StreamPrinter:
+    """Writes streamed text to stdout in batches instead of once per token."""
+    
+    def __init__(self, max_chunks: int = 16, max_delay: float = 0.05):
+        """Initialize printer.
+        
+        Args:
+            max_chunks: Flush once this many chunks are buffered
+            max_delay: Flush once this many seconds have passed since the last flush
+        """
+        self.max_chunks = max_chunks
+        self.max_delay = max_delay
+        self._buffer: list[str] = []
+        self._last_flush = time.monotonic()
+        
+    def write(self, text: str) -> None:
+        """Buffer text, flushing it if the batch is full or stale."""
+        self._buffer.append(text)
+        if (len(self._buffer) >= self.max_chunks
+                or time.monotonic() - self._last_flush > self.max_delay):
+            self.flush()
+            
+    def flush(self) -> None:
+        """Write out any buffered text."""
+        if self._buffer:
+            sys.stdout.write("".join(self._buffer))
+            sys.stdout.flush()
+            self._buffer.clear()
+        self._last_flush = time.monotonic()
+
+class ToolInputError(ValueError):
+    """A streamed tool_use block whose input is not valid JSON.
+    
+    Happens when the response is cut off mid-block (e.g. at max_tokens).
+    The block is kept, with an empty input, so it can still be answered
+    with an error tool_result.
+    """
+    
+    def __init__(self, tool_call: dict, message: str):
+        super().__init__(message)
+        self.tool_call = tool_call
+
+class ToolUseAccumulator:
+    """Assembles tool_use content blocks from a streamed Claude response.
+    
+    A tool call arrives as a content_block_start carrying the id and name,
+    followed by input_json_delta fragments of its input and a
+    content_block_stop.
+    """
+    
+    def __init__(self):
+        """Initialize accumulator."""
+        self._blocks: dict[int, dict] = {}
+        self._input_json: dict[int, list[str]] = {}
+        
+    def start(self, event: Any) -> None:
+        """Begin a block if the content_block_start event is a tool_use."""
+        if event.content_block.type == "tool_use":
+            self._blocks[event.index] = {
+                "type": "tool_use",
+                "id": event.content_block.id,
+                "name": event.content_block.name
+            }
+            self._input_json[event.index] = []
+            
+    def add_delta(self, event: Any) -> None:
+        """Record an input_json_delta fragment for its block."""
+        if event.index in self._input_json:
+            self._input_json[event.index].append(event.delta.partial_json)
+            
+    def stop(self, event: Any) -> Optional[dict]:
+        """Finish a block on content_block_stop.
+        
+        Returns:
+            The completed tool_use block with its parsed input, or None if the
+            stopped block was not a tool_use
+            
+        Raises:
+            ToolInputError: If the accumulated input is not valid JSON
+        """
+        block = self._blocks.pop(event.index, None)
+        if block is None:
+            return None
+        input_json = "".join(self._input_json.pop(event.index))
+        try:
+            block["input"] = json.loads(input_json) if input_json else {}
+        except json.JSONDecodeError as e:
+            block["input"] = {}
+            raise ToolInputError(
+                block, f"Invalid input for tool {block['name']}: {str(e)}") from e
+        return block
 
 class LLMManager:
     """Manages interactions with the LLM."""
@@ -306,120 +642,366 @@ class LLMManager:
             connection_manager: ConnectionManager instance to use
         """
         self.connection_manager = connection_manager
-        self.anthropic = AsyncAnthropic()
+        self.anthropic = _SHARED_ANTHROPIC
+        self._formatted_tools_cache: Optional[tuple[int, List[dict]]] = None
+        self._tool_routing: dict[str, tuple[str, str, Client]] = {}
+        self._response_cache: OrderedDict[bytes, str] = OrderedDict()
         
-    def _format_tools_for_llm(self, server_tools: Dict[str, List[dict]]) -> List[dict]:
+    def _format_tools_for_llm(self, clients: tuple[tuple[str, Client], ...]) -> List[dict]:
         """Format tools from multiple servers for LLM consumption.
         
         Args:
-            server_tools: Dictionary mapping server names to their tools
+            clients: Tuple of (server_name, client) pairs
             
         Returns:
             List of tool definitions for Claude API
+            
+        Raises:
+            ValueError: If two tools map to the same prefixed name, e.g. server
+                ``a_b`` with tool ``c`` and server ``a`` with tool ``b_c``
         """
-        formatted_tools = []
-        for server_name, tools in server_tools.items():
-            for tool in tools:
-                formatted_tools.append({
-                    "name": f"{server_name}_{tool['name']}",
-                    "description": f"[{server_name}] {tool['description']}",
-                    "input_schema": tool['input_schema']
-                })
+        formatted_tools = list(chain.from_iterable(
+            client.tool_definitions for _, client in clients))
+        tool_routing = {}
+        for server_name, client in clients:
+            for tool in client.available_tools:
+                prefixed_name = f"{server_name}_{tool.name}"
+                if prefixed_name in tool_routing:
+                    other_server, other_tool, _ = tool_routing[prefixed_name]
+                    raise ValueError(
+                        f"Tool name {prefixed_name} is ambiguous: {other_server}.{other_tool} "
+                        f"and {server_name}.{tool.name}")
+                tool_routing[prefixed_name] = (server_name, tool.name, client)
+        self._tool_routing = tool_routing
+        
+        # Cache the whole tools prefix; Anthropic caches up to the last marker.
+        # Copy the last entry so the client's prebuilt definition stays unmarked.
+        if formatted_tools:
+            formatted_tools[-1] = {
+                **formatted_tools[-1],
+                "cache_control": {"type": "ephemeral"}
+            }
         return formatted_tools
         
-    async def process_query(self, query: str) -> str:
-        """Process a query using Claude and available tools.
+    async def get_formatted_tools(self) -> List[dict]:
+        """Get tool definitions for Claude API, reusing them across turns.
+        
+        Waits for any servers still listing their tools. The formatted list
+        is rebuilt only when the connection manager's tools version changes.
+        
+        Returns:
+            List of tool definitions for Claude API
+        """
+        await self.connection_manager.wait_for_tools()
+        return self._get_cached_tools()
+        
+    def _get_cached_tools(self) -> List[dict]:
+        """Get the cached tool definitions, rebuilding them if stale.
+        
+        Returns:
+            List of tool definitions for Claude API
+        """
+        version = self.connection_manager.tools_version
+        if self._formatted_tools_cache is None or self._formatted_tools_cache[0] != version:
+            formatted_tools = self._format_tools_for_llm(
+                self.connection_manager.get_all_clients())
+            self._formatted_tools_cache = (version, formatted_tools)
+        return self._formatted_tools_cache[1]
+        
+    def get_tool_route(self, prefixed_name: str) -> tuple[str, str, Client]:
+        """Resolve a tool name as seen by the LLM to its server, tool and client.
         
         Args:
-            query: User query to process
+            prefixed_name: Tool name in the form ``<server_name>_<tool_name>``
             
         Returns:
-            Response text
+            Tuple of (server_name, tool_name, client)
+            
+        Raises:
+            ValueError: If no connected server provides the tool
+        """
+        self._get_cached_tools()
+        if prefixed_name not in self._tool_routing:
+            raise ValueError(f"Tool {prefixed_name} is not available")
+        return self._tool_routing[prefixed_name]
+        
+    async def call_tool(self, prefixed_name: str, tool_args: dict) -> CallToolResult:
+        """Call a tool by the name it has in the LLM's tool list.
+        
+        Args:
+            prefixed_name: Tool name in the form ``<server_name>_<tool_name>``
+            tool_args: Arguments to pass to the tool
+            
+        Returns:
+            Tool execution result
+            
+        Raises:
+            ValueError: If no connected server provides the tool
+        """
+        _, tool_name, client = self.get_tool_route(prefixed_name)
+        return await client.call_tool(tool_name, tool_args)
+        
+    @staticmethod
+    def build_tool_turn(assistant_text: str, tool_calls: list, results: list) -> List[dict]:
+        """Build the assistant tool_use message and the batched tool_result reply.
+        
+        Args:
+            assistant_text: Text the assistant produced alongside the tool calls
+            tool_calls: tool_use blocks from the assistant turn
+                (see ToolUseAccumulator)
+            results: Result or exception for each tool call, in the same order
+            
+        Returns:
+            Assistant and user messages to append to the conversation
+        """
+        assistant_content = []
+        if assistant_text:
+            assistant_content.append({"type": "text", "text": assistant_text})
+        tool_result_content = []
+        for tool_call, result in zip(tool_calls, results):
+            assistant_content.append(tool_call)
+            if isinstance(result, BaseException):
+                tool_result_content.append({
+                    "type": "tool_result",
+                    "tool_use_id": tool_call["id"],
+                    "content": str(result),
+                    "is_error": True
+                })
+            else:
+                tool_result_content.append({
+                    "type": "tool_result",
+                    "tool_use_id": tool_call["id"],
+                    "content": str(result.content)
+                })
+        return [
+            {"role": "assistant", "content": assistant_content},
+            {"role": "user", "content": tool_result_content}
+        ]
+        
+    @staticmethod
+    def cache_first_message(messages: List[dict]) -> None:
+        """Mark the first user message as a prompt-cache breakpoint.
+        
+        Used before follow-up calls so later requests in the same
+        conversation reuse the prefill of the original query.
+        
+        Args:
+            messages: Conversation messages, updated in place
+        """
+        first = messages[0]
+        if isinstance(first["content"], str):
+            messages[0] = {
+                "role": first["role"],
+                "content": [{
+                    "type": "text",
+                    "text": first["content"],
+                    "cache_control": {"type": "ephemeral"}
+                }]
+            }
+        
+    def _response_cache_key(self, messages: List[dict]) -> bytes:
+        """Build the response cache key for a conversation.
+        
+        Args:
+            messages: Messages that will be sent to Claude
+            
+        Returns:
+            Digest of the messages combined with the current tools version
+        """
+        digest = hashlib.blake2b(
+            json.dumps(messages, sort_keys=True).encode()).digest()
+        return digest + self.connection_manager.tools_version.to_bytes(8, "little")
+        
+    def get_cached_response(self, messages: List[dict]) -> Optional[str]:
+        """Look up a previous response to the same conversation.
+        
+        Args:
+            messages: Messages that will be sent to Claude
+            
+        Returns:
+            Cached response text, or None if there is no entry
+        """
+        key = self._response_cache_key(messages)
+        response = self._response_cache.get(key)
+        if response is not None:
+            self._response_cache.move_to_end(key)
+        return response
+        
+    def cache_response(self, messages: List[dict], response: str) -> None:
+        """Store a response, evicting the least recently used entry when full.
+        
+        Responses that involved tool calls should not be cached, since tool
+        results can change between calls.
+        
+        Args:
+            messages: Messages that were sent to Claude
+            response: Response text to cache
+        """
+        key = self._response_cache_key(messages)
+        self._response_cache[key] = response
+        self._response_cache.move_to_end(key)
+        if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
+        
+    async def stream_response(self, query: str) -> AsyncIterator[Any]:
+        """Stream Claude's answer to a query, running any tools it requests.
+        
+        Yields text pieces whose concatenation is the full response, and
+        STREAM_FLUSH markers. Tool calls start as soon as their block ends;
+        any still running are cancelled if the stream fails or the generator
+        is closed early.
+        
+        Args:
+            query: User query to process
+            
+        Yields:
+            Response text pieces, or STREAM_FLUSH
         """
         messages = [{"role": "user", "content": query}]
-        available_tools = self._format_tools_for_llm(
-            self.connection_manager.get_all_tools())
+        available_tools = await self.get_formatted_tools()
+        
+        cached_response = self.get_cached_response(messages)
+        if cached_response is not None:
+            yield cached_response
+            return
+        cache_messages = list(messages)
 
-        # Initial Claude API call with streaming
-        stream = await self.anthropic.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=1000,
-            messages=messages,
-            tools=available_tools,
-            stream=True
-        )
+        # Pieces are separated by "\n" exactly where "\n".join(full_response)
+        # has one, so the streamed text matches the joined response
+        full_response = []
+        current_chunks: list[str] = []
+        tool_blocks = ToolUseAccumulator()
+        pending_tool_calls = []
+        
+        try:
+            # Initial Claude API call with streaming
+            stream = await self.anthropic.messages.create(
+                model="claude-3-5-sonnet-20241022",
+                max_tokens=1000,
+                messages=messages,
+                tools=available_tools,
+                stream=True,
+                extra_headers=PROMPT_CACHING_HEADERS
+            )
+            
+            async with stream:
+                async for event in stream:
+                    if event.type == "message_start":
+                        continue
+                    elif event.type == "content_block_start":
+                        tool_blocks.start(event)
+                    elif event.type == "content_block_delta":
+                        if event.delta.type == "text_delta":
+                            if not current_chunks and full_response:
+                                yield "\n"
+                            current_chunks.append(event.delta.text)
+                            yield event.delta.text
+                        elif event.delta.type == "input_json_delta":
+                            tool_blocks.add_delta(event)
+                    elif event.type == "content_block_stop":
+                        if current_chunks:
+                            full_response.append("".join(current_chunks))
+                            current_chunks.clear()
+                        yield STREAM_FLUSH
+                        try:
+                            tool_call = tool_blocks.stop(event)
+                        except ToolInputError as e:
+                            # Answer the truncated call with an error result
+                            task = asyncio.get_running_loop().create_future()
+                            task.set_exception(e)
+                            pending_tool_calls.append((e.tool_call, task))
+                            continue
+                        if tool_call is not None:
+                            # Start the tool call right away and keep draining the stream
+                            task = asyncio.create_task(
+                                self.call_tool(tool_call["name"], tool_call["input"]))
+                            pending_tool_calls.append((tool_call, task))
+                    elif event.type == "message_stop":
+                        if current_chunks:
+                            full_response.append("".join(current_chunks))
+                            current_chunks.clear()
 
-        tool_results = []
-        final_text = []
-        current_text = ""
+            if current_chunks:
+                full_response.append("".join(current_chunks))
+                current_chunks.clear()
 
-        async for event in stream:
-            if event.type == "message_start":
-                continue
-            elif event.type == "content_block_start":
-                continue
-            elif event.type == "content_block_delta":
-                if event.delta.type == "text_delta":
-                    current_text += event.delta.text
-                    print(event.delta.text, end="", flush=True)
-            elif event.type == "content_block_stop":
-                if current_text:
-                    final_text.append(current_text)
-                    current_text = ""
-            elif event.type == "message_stop":
-                if current_text:
-                    final_text.append(current_text)
-                    current_text = ""
-            elif event.type == "tool_use":
-                # Parse server and tool name
-                server_name, tool_name = event.tool_calls[0].name.split('_', 1)
+            if pending_tool_calls:
+                # Show buffered text before waiting on the tools
+                yield STREAM_FLUSH
+                tool_calls = [tool_call for tool_call, _ in pending_tool_calls]
+                results = await asyncio.gather(
+                    *(task for _, task in pending_tool_calls), return_exceptions=True)
                 
-                try:
-                    client = self.connection_manager.get_client(server_name)
-                    result = await client.call_tool(tool_name, event.tool_calls[0].parameters)
-                    tool_results.append({
-                        "server": server_name,
-                        "tool": tool_name,
-                        "result": result
-                    })
-                    tool_result_text = f"\n[Called {server_name}.{tool_name} with args {event.tool_calls[0].parameters}]\n"
-                    final_text.append(tool_result_text)
-                    print(tool_result_text, end="", flush=True)
-                    
-                    # Continue conversation with tool results
-                    if current_text:
-                        messages.append({
-                            "role": "assistant",
-                            "content": current_text
-                        })
-                    messages.append({
-                        "role": "user",
-                        "content": str(result.content)
-                    })
-                    
-                    # Get next response from Claude with streaming
-                    stream = await self.anthropic.messages.create(
-                        model="claude-3-5-sonnet-20241022",
-                        max_tokens=1000,
-                        messages=messages,
-                        stream=True
-                    )
+                # Answer every tool_use from this turn in a single message
+                messages.extend(self.build_tool_turn(
+                    "\n".join(full_response), tool_calls, results))
                     
+                for tool_call, result in zip(tool_calls, results):
+                    if isinstance(result, BaseException):
+                        tool_text = f"\nError calling {tool_call['name']}: {str(result)}"
+                    else:
+                        server_name, tool_name, _ = self.get_tool_route(tool_call["name"])
+                        tool_text = f"\n[Called {server_name}.{tool_name} with args {tool_call['input']}]\n"
+                    if full_response:
+                        yield "\n"
+                    full_response.append(tool_text)
+                    yield tool_text
+                
+                # Get next response from Claude with streaming
+                self.cache_first_message(messages)
+                stream = await self.anthropic.messages.create(
+                    model="claude-3-5-sonnet-20241022",
+                    max_tokens=1000,
+                    messages=messages,
+                    tools=available_tools,
+                    stream=True,
+                    extra_headers=PROMPT_CACHING_HEADERS
+                )
+                
+                async with stream:
                     async for next_event in stream:
                         if next_event.type == "content_block_delta" and next_event.delta.type == "text_delta":
-                            print(next_event.delta.text, end="", flush=True)
-                            current_text += next_event.delta.text
-                    
-                    if current_text:
-                        final_text.append(current_text)
-                        current_text = ""
-                    
-                except Exception as e:
-                    error_msg = f"\nError calling {server_name}.{tool_name}: {str(e)}"
-                    print(error_msg)
-                    final_text.append(error_msg)
+                            if not current_chunks and full_response:
+                                yield "\n"
+                            current_chunks.append(next_event.delta.text)
+                            yield next_event.delta.text
+                
+                if current_chunks:
+                    full_response.append("".join(current_chunks))
+                    current_chunks.clear()
+        finally:
+            # Runs when the stream fails or the generator is closed early, too
+            tasks = [task for _, task in pending_tool_calls]
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
 
-        return "\n".join(final_text)
+        if not pending_tool_calls:
+            self.cache_response(cache_messages, "\n".join(full_response))
+            
+    async def process_query(self, query: str) -> str:
+        """Process a query using Claude and available tools.
+        
+        Args:
+            query: User query to process
+            
+        Returns:
+            Response text
+        """
+        printer = StreamPrinter()
+        pieces = []
+        try:
+            async with aclosing(self.stream_response(query)) as stream:
+                async for piece in stream:
+                    if piece is STREAM_FLUSH:
+                        printer.flush()
+                        continue
+                    pieces.append(piece)
+                    printer.write(piece)
+        finally:
+            printer.flush()
+        return "".join(pieces)
 
 class Host:
     """MCP host that manages multiple clients and servers."""
@@ -429,13 +1011,21 @@ class Host:
         self.connection_manager = ConnectionManager()
         self.llm_manager = LLMManager(self.connection_manager)
         
-    async def add_server(self, server_name: str, script_path: str, env: dict[str, str] | None = None) -> None:
+    async def add_server(
+        self,
+        server_name: str,
+        script_path: str,
+        env: dict[str, str] | None = None,
+        background_tools: bool = False
+    ) -> None:
         """Add and connect to a new server.
         
         Args:
             server_name: Unique name for the server
             script_path: Path to the server script
             env: Optional environment variables
+            background_tools: List the server's tools in the background
+                (see ConnectionManager.add_connection)
         """
         if script_path.endswith('.py'):
             command = "python"
@@ -448,7 +1038,8 @@ class Host:
             command = script_path
             args = []
             
-        await self.connection_manager.add_connection(server_name, command, args, env)
+        await self.connection_manager.add_connection(
+            server_name, command, args, env, background_tools)
         
     async def chat_loop(self) -> None:
         """Run an interactive chat loop."""
@@ -504,9 +1095,15 @@ async def main() -> None:
             
     host = Host()
     try:
-        # Connect to all servers
-        for server_name, script_path, env in server_configs:
-            await host.add_server(server_name, script_path, env)
+        # Connect to all servers concurrently, letting every attempt finish
+        # before reporting a failure so cleanup sees a settled set of clients
+        results = await asyncio.gather(*(
+            host.add_server(server_name, script_path, env)
+            for server_name, script_path, env in server_configs
+        ), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
             
         await host.chat_loop()
     finally: